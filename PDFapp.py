@@ -10,11 +10,15 @@ Arquivos opcionais na pasta:
 - marcadagua.png       (logo da marca d'água nas fotos)
 - arial.ttf / arialbd.ttf (se quiser Arial; senão cai em Helvetica)
 - ICONS_B64_snippet.py (opcional, com dicionário ICONS_B64)
+Módulo local obrigatório:
+- pdf_tools.py         (costura dos PDFs a partir de páginas em cache e linearização)
 """
 
+import hashlib
 import io
 import os
 import zipfile
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from pathlib import Path
 from typing import List, Dict, Optional, Tuple
@@ -29,6 +33,8 @@ from reportlab.pdfbase import pdfmetrics
 from reportlab.pdfbase.ttfonts import TTFont
 from reportlab.pdfgen import canvas
 
+from pdf_tools import linearize_pdf, merge_pdf_pages
+
 
 # ====================== CONFIG GERAL ======================
 st.set_page_config(page_title="Gerador de PDF Luciano Cavalcante", layout="wide")
@@ -36,6 +42,13 @@ st.set_page_config(page_title="Gerador de PDF Luciano Cavalcante", layout="wide"
 PAGE_SIZE = A4
 PAGE_W, PAGE_H = PAGE_SIZE
 MARGIN = 24
+# Caches por página (modos 1 e 3): as fotos do lote entram recortadas na área
+# visível e reduzidas a LOTE_PAGE_DPI (~1 MB por página em vez de ~3 MB da
+# foto inteira), o que permite guardar lotes grandes sem estourar a memória.
+LOTE_PAGE_DPI = 200
+FRAGMENT_CACHE_ENTRIES = 150
+FRAGMENT_CACHE_TTL = 60 * 60  # segundos
+WEB_MAX_SIDE = 1600  # lado maior das imagens "web" (modo todos os formatos)
 
 # Arquivos locais padrão
 LOGO_PATH = "logotopo.png"
@@ -89,6 +102,16 @@ def get_native_watermark() -> Optional[Image.Image]:
             return None
     return None
 
+def upload_digest(uploaded_file) -> str:
+    """Hash do conteúdo enviado (chave dos caches por página)."""
+    return hashlib.sha1(uploaded_file.getvalue()).hexdigest()
+
+def watermark_digest() -> str:
+    if os.path.exists(WATERMARK_PATH):
+        with open(WATERMARK_PATH, "rb") as fh:
+            return hashlib.sha1(fh.read()).hexdigest()
+    return ""
+
 def icon_reader(key: str) -> Optional[ImageReader]:
     b64 = ICONS_B64.get(key)
     if not b64:
@@ -210,7 +233,12 @@ def process_file(f, wm_img: Image.Image, pos_name: str, scale: float,
     exif_bytes = base.info.get("exif")
     icc = base.info.get("icc_profile")
     processed = watermark_once(base, wm_img, pos_name, scale, opacity, margin, tile)
-    fmt, ext, mime = normalized_format_and_ext(f.name)
+    return encode_processed(processed, f.name, exif_bytes, icc)
+
+def encode_processed(processed: Image.Image, filename: str,
+                     exif_bytes: Optional[bytes], icc: Optional[bytes]):
+    """Codifica a imagem já com marca d'água no formato original (qualidade máxima)."""
+    fmt, ext, mime = normalized_format_and_ext(filename)
     buf = io.BytesIO()
     try:
         if fmt == "JPEG":
@@ -243,6 +271,24 @@ def process_image_for_pdf(f, wm_img: Image.Image, pos_name: str, scale: float,
     processed = watermark_once(base, wm_img, pos_name, scale, opacity, margin, tile)
     return processed.convert("RGB")
 
+def encode_web_jpeg(processed: Image.Image, exif_bytes: Optional[bytes], icc: Optional[bytes]) -> bytes:
+    web = processed.convert("RGB")
+    web.thumbnail((WEB_MAX_SIDE, WEB_MAX_SIDE), Image.Resampling.LANCZOS)
+    buf = io.BytesIO()
+    save_kwargs = {"format": "JPEG", "quality": 82, "optimize": True, "progressive": True}
+    if exif_bytes:
+        save_kwargs["exif"] = exif_bytes  # mantém a orientação (fotos de celular)
+    if icc:
+        save_kwargs["icc_profile"] = icc
+    web.save(buf, **save_kwargs)
+    return buf.getvalue()
+
+def encode_pdf_page(processed: Image.Image) -> bytes:
+    """Página do "PDF único" (mesma saída do Pillow), para costurar com merge_pdf_pages."""
+    buf = io.BytesIO()
+    processed.convert("RGB").save(buf, format="PDF", resolution=300)
+    return buf.getvalue()
+
 # ====================== DESENHO BASE DE IMAGEM ======================
 def draw_image_cover(c: canvas.Canvas, img: Image.Image, x, y, w, h):
     if img is None:
@@ -260,6 +306,31 @@ def draw_image_cover(c: canvas.Canvas, img: Image.Image, x, y, w, h):
     c.drawImage(ImageReader(buf), x + (w - tw) / 2, y + (h - th) / 2, width=tw, height=th, mask="auto")
     c.restoreState()
 
+def draw_fullpage_cover(c: canvas.Canvas, img_rgb: Image.Image):
+    iw, ih = img_rgb.size
+    ratio = max(PAGE_W / iw, PAGE_H / ih)
+    tw, th = int(iw * ratio), int(ih * ratio)
+    buf = io.BytesIO()
+    img_rgb.convert("RGB").save(buf, format="JPEG", quality=95)
+    buf.seek(0)
+    c.saveState()
+    p = c.beginPath()
+    p.rect(0, 0, PAGE_W, PAGE_H)
+    c.clipPath(p, stroke=0, fill=0)
+    c.drawImage(ImageReader(buf), (PAGE_W - tw) / 2, (PAGE_H - th) / 2, width=tw, height=th, mask="auto")
+    c.restoreState()
+
+def fit_to_page(img: Image.Image, dpi: int) -> Image.Image:
+    """Recorta a imagem na área que draw_fullpage_cover mostra e reduz para `dpi` na página."""
+    iw, ih = img.size
+    ratio = max(PAGE_W / iw, PAGE_H / ih)
+    cw, ch = PAGE_W / ratio, PAGE_H / ratio
+    box = (round((iw - cw) / 2), round((ih - ch) / 2), round((iw + cw) / 2), round((ih + ch) / 2))
+    target = (round(PAGE_W / 72 * dpi), round(PAGE_H / 72 * dpi))
+    if box[2] - box[0] <= target[0]:
+        return img.crop(box)
+    return img.resize(target, Image.Resampling.LANCZOS, box=box)
+
 # ====================== FOLHETO (Q2 expandido) ======================
 def draw_q2_expanded_page(
     c: canvas.Canvas,
@@ -420,32 +491,35 @@ def draw_q2_expanded_page(
                 pass
         draw_image_cover(c, hero_img, content_x, MARGIN, content_w, photo_h)
 
-# Builder do folheto
-@st.cache_data(show_spinner=False)
+# Builder do folheto (também é a 1ª página do modo 3). A chave do cache é o
+# hash da foto de capa e da marca d'água, não as imagens em si.
+@st.cache_data(show_spinner=False, max_entries=8, ttl=FRAGMENT_CACHE_TTL)
 def build_folheto_pdf(
-    hero_img: Optional[Image.Image],
+    hero_digest: str,
     empreendimento: str,
     bairro: str,
     preco_texto: str,
     detalhes: Dict[str, str],
     *,
-    wm_for_cover: Optional[Image.Image],
+    wm_digest: str,
     wm_position: str,
     wm_scale: float,
     wm_opacity: float,
     wm_margin: int,
     wm_tile: bool,
+    _hero_file,
+    _wm_for_cover: Optional[Image.Image],
 ) -> bytes:
     output = io.BytesIO()
     c = canvas.Canvas(output, pagesize=PAGE_SIZE, pageCompression=1)
     draw_q2_expanded_page(
         c, PAGE_W, PAGE_H,
-        hero_img=hero_img,
+        hero_img=pil_from_upload(_hero_file),
         empreendimento=empreendimento,
         bairro=bairro,
         detalhes=detalhes,
         preco_texto=preco_texto,
-        wm_img=wm_for_cover,
+        wm_img=_wm_for_cover,
         wm_position=wm_position,
         wm_scale=wm_scale,
         wm_opacity=wm_opacity,
@@ -457,6 +531,68 @@ def build_folheto_pdf(
     output.seek(0)
     return output.read()
 
+# ====================== FRAGMENTOS (modo 3) ======================
+# Cada página do PDF combinado é gerada como um PDF de 1 página e fica em
+# cache (a capa via build_folheto_pdf); ao gerar de novo só as páginas que
+# mudaram são redesenhadas e o documento final é costurado a partir dos
+# fragmentos (pdf_tools).
+@st.cache_data(show_spinner=False, max_entries=FRAGMENT_CACHE_ENTRIES, ttl=FRAGMENT_CACHE_TTL)
+def render_lote_fragment(
+    file_digest: str,
+    wm_digest: str,
+    pos_name: str,
+    scale: float,
+    opacity: float,
+    margin: int,
+    tile: bool,
+    *,
+    _file,
+    _wm_img: Image.Image,
+) -> bytes:
+    img = process_image_for_pdf(_file, _wm_img, pos_name, scale, opacity, margin, tile)
+    output = io.BytesIO()
+    c = canvas.Canvas(output, pagesize=PAGE_SIZE, pageCompression=1)
+    draw_fullpage_cover(c, fit_to_page(img, LOTE_PAGE_DPI))
+    c.showPage()
+    c.save()
+    return output.getvalue()
+
+# ====================== TODOS OS FORMATOS (modo 2) ======================
+# Cada foto é decodificada e recebe a marca d'água uma única vez; a mesma
+# imagem alimenta os três codificadores (original, web e página do PDF), que
+# rodam em paralelo (o Pillow libera o GIL ao codificar). Sem cache entre
+# execuções: as três saídas de cada foto ocupariam vários MB.
+def render_all_outputs(f, wm_img: Image.Image, pos_name: str, scale: float,
+                       opacity: float, margin: int, tile: bool) -> Tuple[bytes, str, str, bytes, bytes]:
+    """Retorna (original, ext, mime, jpeg web, página PDF)."""
+    base = Image.open(f)
+    exif_bytes = base.info.get("exif")
+    icc = base.info.get("icc_profile")
+    processed = watermark_once(base, wm_img, pos_name, scale, opacity, margin, tile)
+    with ThreadPoolExecutor(max_workers=3) as pool:
+        full = pool.submit(encode_processed, processed, f.name, exif_bytes, icc)
+        web = pool.submit(encode_web_jpeg, processed, exif_bytes, icc)
+        page = pool.submit(encode_pdf_page, processed)
+    data, ext, mime = full.result()
+    return data, ext, mime, web.result(), page.result()
+
+def unique_zip_name(zf: zipfile.ZipFile, filename: str, tag: str, ext: str) -> str:
+    """
+    Nome "{base}_{tag}.{ext}" ainda livre no ZIP. Uploads com o mesmo nome base
+    (foto.jpg e foto.jpeg, ou dois IMG_0001.jpg) recebem a extensão de origem
+    e, se ainda colidir, um contador.
+    """
+    base_name = Path(filename).stem
+    taken = set(zf.namelist())
+    name = f"{base_name}_{tag}.{ext}"
+    if name in taken:
+        name = f"{base_name}_{Path(filename).suffix.lstrip('.').lower()}_{tag}.{ext}"
+    n = 2
+    while name in taken:
+        name = f"{base_name}_{tag}_{n}.{ext}"
+        n += 1
+    return name
+
 # ============== UI ==============
 st.title("Gerador de PDF Luciano Cavalcante")
 
@@ -466,6 +602,9 @@ modo = st.sidebar.radio(
     ["Folheto (Layout único)", "Marca d'água em lote", "Folheto + anexar fotos do lote"],
     index=0
 )
+web_pdf = st.sidebar.checkbox(
+    "PDF otimizado para web (1ª página abre antes do download terminar)", value=True
+)
 
 # --------- Sidebar: Marca d'água (para fotos e capa) ---------
 with st.sidebar.expander("Marca d'água (para fotos e capa)", expanded=True):
@@ -521,7 +660,7 @@ with col5:
 # --------- Saída do modo 2 ---------
 if modo == "Marca d'água em lote":
     st.subheader("Saída do lote")
-    output_mode = st.radio("Como deseja baixar?", ["PDF único", "Arquivos individuais", "ZIP"], index=0)
+    output_mode = st.radio("Como deseja baixar?", ["PDF único", "Arquivos individuais", "ZIP", "Todos os formatos"], index=0)
 
 # ====================== BOTÕES/EXECUÇÃO ======================
 def detalhes_from_inputs():
@@ -537,20 +676,23 @@ if modo == "Folheto (Layout único)":
             st.error("Coloque o arquivo 'marcadagua.png' na pasta do app.")
         else:
             with st.spinner("Gerando PDF do folheto..."):
-                hero_img = pil_from_upload(hero_file)
                 pdf_bytes = build_folheto_pdf(
-                    hero_img,
+                    upload_digest(hero_file),
                     empreendimento,
                     bairro,
                     preco_texto,
                     detalhes_from_inputs(),
-                    wm_for_cover=wm_img_selected,
+                    wm_digest=watermark_digest(),
                     wm_position=position,
                     wm_scale=scale_pct/100.0,
                     wm_opacity=opacity_pct/100.0,
                     wm_margin=margin_px,
                     wm_tile=repeat_tile,
+                    _hero_file=hero_file,
+                    _wm_for_cover=wm_img_selected,
                 )
+                if web_pdf:
+                    pdf_bytes = linearize_pdf(pdf_bytes)
                 st.download_button(
                     "Baixar PDF (folheto)",
                     pdf_bytes,
@@ -576,9 +718,12 @@ if modo == "Marca d'água em lote":
             if pages:
                 pdf_buf = io.BytesIO()
                 pages[0].save(pdf_buf, format="PDF", save_all=True, append_images=pages[1:], resolution=300)
+                pdf_bytes = pdf_buf.getvalue()
+                if web_pdf:
+                    pdf_bytes = linearize_pdf(pdf_bytes)
                 st.download_button(
                     label="⬇️ Baixar PDF único",
-                    data=pdf_buf.getvalue(),
+                    data=pdf_bytes,
                     file_name="imagens_marcadagua.pdf",
                     mime="application/pdf",
                 )
@@ -599,6 +744,54 @@ if modo == "Marca d'água em lote":
                 done += 1
                 prog.progress(int(done/total*100), text=f"{done}/{total} concluídas")
 
+        elif output_mode == "Todos os formatos":
+            # Cada download reexecuta o script: o último resultado fica na sessão
+            # (só desta sessão, não no cache global) e é reaproveitado enquanto
+            # fotos e opções não mudarem.
+            run_key = (
+                tuple((f.name, upload_digest(f)) for f in img_files), watermark_digest(),
+                position, scale_pct, opacity_pct, margin_px, repeat_tile, web_pdf,
+            )
+            last = st.session_state.get("todos_os_formatos")
+            if last is None or last[0] != run_key:
+                zip_full, zip_web = io.BytesIO(), io.BytesIO()
+                pdf_pages = []
+                with zipfile.ZipFile(zip_full, mode="w", compression=zipfile.ZIP_STORED) as zf, \
+                        zipfile.ZipFile(zip_web, mode="w", compression=zipfile.ZIP_STORED) as zw:
+                    done = 0
+                    for f in img_files:
+                        data, ext, _, web, page = render_all_outputs(
+                            f, wm_img_selected, position, scale_pct/100.0, opacity_pct/100.0, margin_px, repeat_tile
+                        )
+                        zf.writestr(unique_zip_name(zf, f.name, "marcadagua", ext), data)
+                        zw.writestr(unique_zip_name(zw, f.name, "web", "jpg"), web)
+                        pdf_pages.append(page)
+                        done += 1
+                        prog.progress(int(done/total*100), text=f"{done}/{total} processadas")
+                last = (run_key, merge_pdf_pages(pdf_pages, linearize=web_pdf), zip_full.getvalue(), zip_web.getvalue())
+                st.session_state["todos_os_formatos"] = last
+            else:
+                prog.progress(100, text=f"{total}/{total} processadas")
+            _, pdf_bytes, zip_full_bytes, zip_web_bytes = last
+            st.download_button(
+                label="⬇️ Baixar PDF único",
+                data=pdf_bytes,
+                file_name="imagens_marcadagua.pdf",
+                mime="application/pdf",
+            )
+            st.download_button(
+                label="⬇️ Baixar todas em .zip (qualidade máxima)",
+                data=zip_full_bytes,
+                file_name="imagens_marcadagua.zip",
+                mime="application/zip",
+            )
+            st.download_button(
+                label=f"⬇️ Baixar todas em .zip (web, até {WEB_MAX_SIDE}px)",
+                data=zip_web_bytes,
+                file_name="imagens_web.zip",
+                mime="application/zip",
+            )
+
         else:  # ZIP
             zip_buffer = io.BytesIO()
             with zipfile.ZipFile(zip_buffer, mode="w", compression=zipfile.ZIP_STORED) as zf:
@@ -631,55 +824,39 @@ if modo == "Folheto + anexar fotos do lote":
             st.error("Coloque o arquivo 'marcadagua.png' na pasta do app.")
         else:
             with st.spinner("Montando PDF completo..."):
-                out = io.BytesIO()
-                c = canvas.Canvas(out, pagesize=PAGE_SIZE, pageCompression=1)
+                wm_digest = watermark_digest()
+                wm_args = (position, scale_pct/100.0, opacity_pct/100.0, margin_px, repeat_tile)
 
                 # 1) Página 1: folheto (capa com a MESMA marca d'água e configurações)
-                hero_img = pil_from_upload(hero_file)
-                draw_q2_expanded_page(
-                    c, PAGE_W, PAGE_H,
-                    hero_img=hero_img,
-                    empreendimento=empreendimento,
-                    bairro=bairro,
-                    detalhes=detalhes_from_inputs(),
-                    preco_texto=preco_texto,
-                    wm_img=wm_img_selected,
+                fragments = [build_folheto_pdf(
+                    upload_digest(hero_file),
+                    empreendimento,
+                    bairro,
+                    preco_texto,
+                    detalhes_from_inputs(),
+                    wm_digest=wm_digest,
                     wm_position=position,
                     wm_scale=scale_pct/100.0,
                     wm_opacity=opacity_pct/100.0,
                     wm_margin=margin_px,
                     wm_tile=repeat_tile,
-                )
-                c.showPage()
-
-                # 2) Demais páginas: cada foto do lote com marca d'água
-                def draw_fullpage_cover(img_rgb: Image.Image):
-                    iw, ih = img_rgb.size
-                    ratio = max(PAGE_W / iw, PAGE_H / ih)
-                    tw, th = int(iw * ratio), int(ih * ratio)
-                    buf = io.BytesIO()
-                    img_rgb.convert("RGB").save(buf, format="JPEG", quality=95)
-                    buf.seek(0)
-                    c.saveState()
-                    p = c.beginPath()
-                    p.rect(0, 0, PAGE_W, PAGE_H)
-                    c.clipPath(p, stroke=0, fill=0)
-                    c.drawImage(ImageReader(buf), (PAGE_W - tw) / 2, (PAGE_H - th) / 2, width=tw, height=th, mask="auto")
-                    c.restoreState()
+                    _hero_file=hero_file,
+                    _wm_for_cover=wm_img_selected,
+                )]
 
+                # 2) Demais páginas: cada foto do lote com marca d'água (só as novas são renderizadas)
                 for f in img_files:
-                    img = process_image_for_pdf(
-                        f, wm_img_selected, position, scale_pct/100.0, opacity_pct/100.0, margin_px, repeat_tile
-                    )
-                    draw_fullpage_cover(img)
-                    c.showPage()
+                    fragments.append(render_lote_fragment(
+                        upload_digest(f), wm_digest, *wm_args,
+                        _file=f,
+                        _wm_img=wm_img_selected,
+                    ))
 
-                c.save()
-                out.seek(0)
+                pdf_bytes = merge_pdf_pages(fragments, linearize=web_pdf)
 
                 st.download_button(
                     "Baixar PDF (folheto + fotos do lote)",
-                    out.getvalue(),
+                    pdf_bytes,
                     file_name=f"folheto_com_lote_{datetime.now().strftime('%Y%m%d_%H%M%S')}.pdf",
                     mime="application/pdf",
                 )
@@ -687,6 +864,6 @@ if modo == "Folheto + anexar fotos do lote":
 # Rodapé
 st.caption(
     "• Folheto com logo reduzida, título em 1 linha (auto-fit), pílulas numa linha e faixa de preço compacta.  "
-    "• Lote com marca d'água: PDF único / arquivos / ZIP.  "
+    "• Lote com marca d'água: PDF único / arquivos / ZIP / todos os formatos de uma vez.  "
     "• Modo combinado: folheto na 1ª página e fotos do lote em páginas extras, todas com a mesma marca d'água."
 )
@@ -0,0 +1,149 @@
+"""
+Benchmark da saída em PDF: bytes até a 1ª página e tamanho total.
+
+Compara, para os três caminhos de PDF do app, a saída de hoje (sem
+linearização) com a saída otimizada para web (linearizada, com streams de
+objetos), com as mesmas configurações do ReportLab nas duas. Nos modos 1 e 2
+a diferença medida é só a da linearização; no modo 3 as fotos do lote também
+entram reduzidas a PDFapp.LOTE_PAGE_DPI. Num PDF comum o leitor precisa do
+arquivo inteiro (a xref fica no fim); num linearizado a 1ª página pode ser
+mostrada após os primeiros /E bytes.
+
+Uso: python benchmark_pdf.py [--fotos 12] [--largura 3000] [--altura 2000]
+"""
+
+import argparse
+import io
+import logging
+import re
+import time
+
+logging.disable(logging.WARNING)  # avisos do Streamlit fora de `streamlit run`
+
+from PIL import Image  # noqa: E402
+from reportlab.pdfgen import canvas  # noqa: E402
+
+import PDFapp as app  # noqa: E402
+from pdf_tools import linearize_pdf, merge_pdf_pages  # noqa: E402
+
+WM_ARGS = ("Canto inferior direito", 0.20, 0.60, 24, False)
+TEXTOS = dict(empreendimento="Residencial Exemplo", bairro="Meireles", preco_texto="R$ 850.000 a R$ 1.200.000",
+              detalhes={"quartos": "3", "suites": "2", "banheiros": "3", "vagas": "2", "m2": "120", "pet": "Sim"})
+
+
+class FakeUpload(io.BytesIO):
+    """Imita o UploadedFile do Streamlit (BytesIO com .name)."""
+    def __init__(self, data: bytes, name: str):
+        super().__init__(data)
+        self.name = name
+
+
+def synthetic_photo(i: int, size) -> FakeUpload:
+    w, h = size
+    noise = Image.effect_noise((w // 16, h // 16), 64).resize((w, h), Image.Resampling.BICUBIC)
+    grad = Image.linear_gradient("L").resize((w, h))
+    img = Image.merge("RGB", (grad, noise, Image.blend(grad, noise, 0.3 + 0.05 * (i % 8))))
+    buf = io.BytesIO()
+    img.save(buf, format="JPEG", quality=90)
+    return FakeUpload(buf.getvalue(), f"foto_{i:02d}.jpg")
+
+
+def bytes_to_first_page(pdf: bytes) -> int:
+    m = re.search(rb"/Linearized\s+1\b.*?/E\s+(\d+)", pdf[:1024], re.S)
+    return int(m.group(1)) if m else len(pdf)
+
+
+# As funções do app são chamadas sem o cache do Streamlit (__wrapped__), para
+# medir o trabalho de verdade a cada execução.
+def cover_pdf(hero: FakeUpload, wm) -> bytes:
+    hero.seek(0)
+    return app.build_folheto_pdf.__wrapped__(
+        app.upload_digest(hero), TEXTOS["empreendimento"], TEXTOS["bairro"],
+        TEXTOS["preco_texto"], TEXTOS["detalhes"],
+        wm_digest="", wm_position=WM_ARGS[0], wm_scale=WM_ARGS[1], wm_opacity=WM_ARGS[2],
+        wm_margin=WM_ARGS[3], wm_tile=WM_ARGS[4],
+        _hero_file=hero, _wm_for_cover=wm,
+    )
+
+
+def lote_pdf_pil(files, wm) -> bytes:
+    pages = []
+    for f in files:
+        f.seek(0)
+        pages.append(app.process_image_for_pdf(f, wm, *WM_ARGS))
+    buf = io.BytesIO()
+    pages[0].save(buf, format="PDF", save_all=True, append_images=pages[1:], resolution=300)
+    return buf.getvalue()
+
+
+def combined_today(hero, files, wm) -> bytes:
+    """Modo 3 como era antes: um único canvas redesenhando todas as páginas."""
+    out = io.BytesIO()
+    c = canvas.Canvas(out, pagesize=app.PAGE_SIZE, pageCompression=1)
+    app.draw_q2_expanded_page(
+        c, app.PAGE_W, app.PAGE_H, hero_img=app.pil_from_upload(hero), wm_img=wm,
+        wm_position=WM_ARGS[0], wm_scale=WM_ARGS[1], wm_opacity=WM_ARGS[2],
+        wm_margin=WM_ARGS[3], wm_tile=WM_ARGS[4], **TEXTOS,
+    )
+    c.showPage()
+    for f in files:
+        f.seek(0)
+        app.draw_fullpage_cover(c, app.process_image_for_pdf(f, wm, *WM_ARGS))
+        c.showPage()
+    c.save()
+    return out.getvalue()
+
+
+def combined_web(hero, files, wm) -> bytes:
+    fragments = [cover_pdf(hero, wm)]
+    for f in files:
+        f.seek(0)
+        fragments.append(app.render_lote_fragment.__wrapped__(
+            app.upload_digest(f), "", *WM_ARGS, _file=f, _wm_img=wm,
+        ))
+    return merge_pdf_pages(fragments, linearize=True)
+
+
+def timed(fn, *args):
+    t0 = time.perf_counter()
+    data = fn(*args)
+    return data, time.perf_counter() - t0
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    ap.add_argument("--fotos", type=int, default=12)
+    ap.add_argument("--largura", type=int, default=3000)
+    ap.add_argument("--altura", type=int, default=2000)
+    args = ap.parse_args()
+
+    wm = app.get_native_watermark()
+    hero = synthetic_photo(99, (args.largura, args.altura))
+    files = [synthetic_photo(i, (args.largura, args.altura)) for i in range(args.fotos)]
+
+    rows = []
+    for nome, hoje, web in (
+        ("Folheto (modo 1)",
+         lambda: cover_pdf(hero, wm),
+         lambda: linearize_pdf(cover_pdf(hero, wm))),
+        (f"PDF único, {args.fotos} fotos (modo 2)",
+         lambda: lote_pdf_pil(files, wm),
+         lambda: linearize_pdf(lote_pdf_pil(files, wm))),
+        (f"Folheto + {args.fotos} fotos (modo 3)",
+         lambda: combined_today(hero, files, wm),
+         lambda: combined_web(hero, files, wm)),
+    ):
+        before, t_before = timed(hoje)
+        after, t_after = timed(web)
+        rows.append((nome, before, t_before, after, t_after))
+
+    print(f"{'caminho':<32} {'saída':<6} {'1ª página (bytes)':>18} {'total (bytes)':>14} {'tempo (s)':>10}")
+    for nome, before, t_before, after, t_after in rows:
+        for label, data, t in (("hoje", before, t_before), ("web", after, t_after)):
+            print(f"{nome:<32} {label:<6} {bytes_to_first_page(data):>18,} {len(data):>14,} {t:>10.2f}")
+        ratio = bytes_to_first_page(after) / bytes_to_first_page(before)
+        print(f"{'':<32} {'':<6} {ratio:>17.1%} {len(after) / len(before):>13.1%}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,447 @@
+"""
+Montagem de PDFs a partir de fragmentos já renderizados.
+
+Cada fragmento é um PDF completo (gerado pelo ReportLab ou pelo Pillow). Aqui
+as páginas de vários fragmentos são recolhidas, renumeradas e costuradas num
+único documento, sem redesenhar nada: só os objetos são copiados.
+
+Opcionalmente o resultado sai linearizado ("Fast Web View", anexo F da
+especificação PDF), com streams de objetos e de xref: o leitor consegue
+mostrar a 1ª página assim que recebe os primeiros /E bytes do arquivo.
+
+Suporta apenas o que os geradores usados no app produzem (tabela xref
+clássica, objetos não comprimidos). Sem dependências externas.
+"""
+
+import bisect
+import hashlib
+import re
+import struct
+import time
+import zlib
+from typing import Dict, List, Set, Tuple
+
+_REF_RE = re.compile(rb"(\d+)\s+(\d+)\s+R\b")
+_OBJ_HEADER_RE = re.compile(rb"\s*(\d+)\s+(\d+)\s+obj\b")
+_PARENT_RE = re.compile(rb"/Parent\s+\d+\s+\d+\s+R")
+
+
+# ====================== LEITURA ======================
+def _read_xref_offsets(data: bytes) -> Tuple[Dict[int, int], int, bytes]:
+    """Retorna ({num: offset}, offset da xref, dicionário do trailer)."""
+    sx = data.rfind(b"startxref")
+    if sx < 0:
+        raise ValueError("PDF sem 'startxref'")
+    xref_at = int(data[sx + 9:].split()[0])
+    if not data.startswith(b"xref", xref_at):
+        raise ValueError("Somente PDFs com tabela xref clássica são suportados")
+
+    offsets: Dict[int, int] = {}
+    lines = data[xref_at:].split(b"trailer", 1)[0].split(b"\n")[1:]
+    i = 0
+    while i < len(lines):
+        parts = lines[i].split()
+        i += 1
+        if len(parts) != 2:
+            continue
+        start, count = int(parts[0]), int(parts[1])
+        for num in range(start, start + count):
+            entry = lines[i].split()
+            i += 1
+            if entry[2] == b"n":
+                offsets[num] = int(entry[0])
+
+    trailer_at = data.find(b"trailer", xref_at)
+    trailer = data[trailer_at + 7:data.find(b"startxref", trailer_at)]
+    return offsets, xref_at, trailer
+
+
+def read_pdf_objects(data: bytes) -> Tuple[Dict[int, bytes], List[int], int]:
+    """Lê um PDF e devolve ({num: corpo do objeto}, [páginas em ordem], num do /Info ou 0)."""
+    offsets, xref_at, trailer = _read_xref_offsets(data)
+    bounds = sorted(offsets.values()) + [xref_at]
+
+    objects: Dict[int, bytes] = {}
+    for num, off in offsets.items():
+        end = bounds[bisect.bisect_right(bounds, off)]
+        m = _OBJ_HEADER_RE.match(data, off)
+        if not m or int(m.group(1)) != num:
+            raise ValueError(f"Objeto {num} não encontrado no offset {off}")
+        chunk = data[m.end():end]
+        objects[num] = chunk[:chunk.rfind(b"endobj")].strip()
+
+    root = _ref_value(trailer, b"/Root")
+    pages_root = _ref_value(objects[root], b"/Pages")
+    info = _ref_value(trailer, b"/Info") if b"/Info" in trailer else 0
+    return objects, _collect_kids(objects, pages_root), info
+
+
+def _ref_value(body: bytes, key: bytes) -> int:
+    m = re.search(re.escape(key) + rb"\s+(\d+)\s+\d+\s+R", body)
+    if not m:
+        raise ValueError(f"Chave {key.decode()} não encontrada")
+    return int(m.group(1))
+
+
+def _collect_kids(objects: Dict[int, bytes], node: int) -> List[int]:
+    body = dict_part(objects[node])
+    if not re.search(rb"/Type\s*/Pages\b", body):
+        return [node]
+    kids = re.search(rb"/Kids\s*\[([^\]]*)\]", body)
+    pages: List[int] = []
+    for m in _REF_RE.finditer(kids.group(1) if kids else b""):
+        pages.extend(_collect_kids(objects, int(m.group(1))))
+    return pages
+
+
+def dict_part(body: bytes) -> bytes:
+    """Parte do objeto antes do 'stream' (onde ficam as referências)."""
+    m = re.search(rb">>\s*stream(\r\n|\n)", body)
+    return body[:m.start() + 2] if m else body
+
+
+# ====================== COSTURA ======================
+def _reachable(objects: Dict[int, bytes], page: int) -> List[int]:
+    """Objetos usados pela página (sem subir pelo /Parent)."""
+    seen, order, todo = set(), [], [page]
+    while todo:
+        num = todo.pop()
+        if num in seen or num not in objects:
+            continue
+        seen.add(num)
+        order.append(num)
+        head = _PARENT_RE.sub(b"", dict_part(objects[num]))
+        todo.extend(int(m.group(1)) for m in _REF_RE.finditer(head))
+    return order
+
+
+def _renumber(body: bytes, mapping: Dict[int, int]) -> bytes:
+    head = dict_part(body)
+    new_head = _REF_RE.sub(
+        lambda m: b"%d 0 R" % mapping.get(int(m.group(1)), int(m.group(1))), head
+    )
+    return new_head + body[len(head):]
+
+
+def collect_pages(fragments: List[bytes]) -> Tuple[Dict[int, bytes], List[int], int, int]:
+    """
+    Junta as páginas de todos os fragmentos num único conjunto de objetos.
+    Retorna ({num: corpo}, [páginas], num do nó /Pages, num do /Info); o nó
+    /Pages e o catálogo ainda não estão incluídos. O /Info (produtor, datas,
+    título) é o do 1º fragmento; 0 se ele não tiver.
+    """
+    merged: Dict[int, bytes] = {}
+    pages: List[int] = []
+    info_num = 0
+    next_num = 1
+    for k, data in enumerate(fragments):
+        objects, page_nums, info = read_pdf_objects(data)
+        mapping: Dict[int, int] = {}
+        roots = page_nums + ([info] if k == 0 and info else [])
+        for root in roots:
+            for num in _reachable(objects, root):
+                if num not in mapping:
+                    mapping[num] = next_num
+                    next_num += 1
+        pages += [mapping[page] for page in page_nums]
+        if k == 0 and info:
+            info_num = mapping[info]
+        for old, new in mapping.items():
+            merged[new] = _renumber(objects[old], mapping)
+
+    pages_num = next_num
+    for p in pages:
+        merged[p] = _PARENT_RE.sub(b"/Parent %d 0 R" % pages_num, merged[p])
+    return merged, pages, pages_num, info_num
+
+
+def _trailer_extra(info_num: int, info_body: bytes, count: int) -> bytes:
+    """/Info (se houver) e um /ID novo para o trailer."""
+    seed = b"%r %d " % (time.time(), count) + info_body
+    file_id = hashlib.md5(seed).hexdigest().encode()
+    info = b"/Info %d 0 R " % info_num if info_num else b""
+    return info + b"/ID [ <%s> <%s> ]" % (file_id, file_id)
+
+
+def _write_classic(objects: Dict[int, bytes], root: int, info_num: int) -> bytes:
+    out = bytearray(b"%PDF-1.4\n%\xe2\xe3\xcf\xd3\n")
+    size = max(objects) + 1
+    offsets = [0] * size
+    for num in sorted(objects):
+        offsets[num] = len(out)
+        out += b"%d 0 obj\n" % num + objects[num] + b"\nendobj\n"
+
+    xref_at = len(out)
+    out += b"xref\n0 %d\n0000000000 65535 f \n" % size
+    for num in range(1, size):
+        if num in objects:
+            out += b"%010d 00000 n \n" % offsets[num]
+        else:
+            out += b"0000000000 65535 f \n"
+    out += b"trailer\n<< /Root %d 0 R /Size %d %s >>\nstartxref\n%d\n%%%%EOF\n" % (
+        root, size, _trailer_extra(info_num, objects.get(info_num, b""), size), xref_at)
+    return bytes(out)
+
+
+# ====================== LINEARIZAÇÃO ======================
+_LIN_FIELD = b"%10d"  # campos com largura fixa: o cabeçalho é escrito antes de saber os offsets
+_XREF_W = (1, 4, 2)
+
+
+def _is_stream(body: bytes) -> bool:
+    return len(dict_part(body)) != len(body)
+
+
+def _obj(num: int, body: bytes) -> bytes:
+    return b"%d 0 obj\n" % num + body + b"\nendobj\n"
+
+
+def _stream_obj(num: int, entries: bytes, data: bytes) -> bytes:
+    return _obj(num, b"<< %s /Length %d >>\nstream\n" % (entries, len(data)) + data + b"\nendstream")
+
+
+def _pack_bits(values: List[int], nbits: int) -> bytes:
+    """Um item das tabelas de dicas: valores de nbits, completando o último byte."""
+    if not nbits or not values:
+        return b""
+    bits = "".join(format(v, "0%db" % nbits) for v in values)
+    bits += "0" * (-len(bits) % 8)
+    return int(bits, 2).to_bytes(len(bits) // 8, "big")
+
+
+def _xref_rows(entries: List[Tuple[int, int, int]]) -> bytes:
+    w1, w2, w3 = _XREF_W
+    return b"".join(
+        t.to_bytes(w1, "big") + f2.to_bytes(w2, "big") + f3.to_bytes(w3, "big")
+        for t, f2, f3 in entries
+    )
+
+
+def _hint_tables(
+    page_ranges: List[Tuple[int, int]],
+    shared_groups: List[int],
+    shared_refs: List[List[int]],
+    first_page_offset: int,
+    nshared_first_page: int,
+    first_shared: Tuple[int, int],
+) -> Tuple[bytes, int]:
+    """
+    Monta as tabelas de dicas (F.4.1 e F.4.2). page_ranges traz
+    (nº de objetos, tamanho em bytes) por página; shared_groups o tamanho de
+    cada objeto compartilhado (grupos de 1 objeto). Offsets já "ajustados",
+    isto é, como se o stream de dicas não existisse.
+    Retorna (dados, offset da tabela de compartilhados).
+    """
+    nobjs = [n for n, _ in page_ranges]
+    lengths = [ln for _, ln in page_ranges]
+    min_n, min_len = min(nobjs), min(lengths)
+    nb_n = (max(nobjs) - min_n).bit_length()
+    nb_len = (max(lengths) - min_len).bit_length()
+    nb_nshared = max(len(r) for r in shared_refs).bit_length()
+    nb_shared_id = len(shared_groups).bit_length()
+
+    page_table = struct.pack(
+        ">IIHIHIHIHHHHH",
+        min_n, first_page_offset, nb_n,
+        min_len, nb_len,
+        0, 0,              # offset do conteúdo: sempre 0 (como o qpdf/Acrobat)
+        min_len, nb_len,   # tamanho do conteúdo: igual ao tamanho da página
+        nb_nshared, nb_shared_id, 0, 4,
+    )
+    page_table += _pack_bits([n - min_n for n in nobjs], nb_n)
+    page_table += _pack_bits([ln - min_len for ln in lengths], nb_len)
+    page_table += _pack_bits([len(r) for r in shared_refs], nb_nshared)
+    page_table += _pack_bits([i for r in shared_refs for i in r], nb_shared_id)
+    page_table += _pack_bits([ln - min_len for ln in lengths], nb_len)
+
+    min_group = min(shared_groups)
+    nb_group = (max(shared_groups) - min_group).bit_length()
+    shared_table = struct.pack(
+        ">IIIIHIH",
+        first_shared[0], first_shared[1],
+        nshared_first_page, len(shared_groups),
+        0, min_group, nb_group,
+    )
+    shared_table += _pack_bits([g - min_group for g in shared_groups], nb_group)
+    shared_table += _pack_bits([0] * len(shared_groups), 1)  # sem assinaturas MD5
+    return page_table + shared_table, len(page_table)
+
+
+def _write_linearized(objects: Dict[int, bytes], pages: List[int], pages_num: int, info_num: int) -> bytes:
+    """
+    Ordem do arquivo (anexo F): linearização, xref da 1ª página, catálogo,
+    dicas, objetos da 1ª página (+ stream de objetos), demais páginas,
+    objetos compartilhados, árvore de páginas, /Info e xref principal. Dicionários
+    sem stream vão comprimidos num único stream de objetos; páginas e streams
+    ficam fora (as páginas precisam de offset próprio nas dicas).
+    """
+    users: Dict[int, Set[int]] = {}
+    reach: List[List[int]] = []
+    for i, page in enumerate(pages):
+        reach.append(_reachable(objects, page))
+        for num in reach[-1]:
+            users.setdefault(num, set()).add(i)
+
+    page_set = set(pages)
+    extra = [n for n in sorted(objects) if n not in users]  # /Info e o que ele referencia
+    compressed = [n for n in sorted(objects)
+                  if n in users and n not in page_set and not _is_stream(objects[n])]
+    in_objstm = set(compressed)
+
+    part6 = [n for n in reach[0] if n not in in_objstm]
+    first = set(part6)
+    part7: List[List[int]] = []
+    part8: List[int] = []
+    for i in range(1, len(pages)):
+        own = [n for n in reach[i] if n not in in_objstm and users[n] == {i}]
+        part7.append(own)
+        part8 += [n for n in reach[i] if n not in in_objstm and n not in first
+                  and len(users[n]) > 1 and n not in part8]
+
+    # numeração: parte baixa (demais páginas ... xref principal), parte alta (início do arquivo)
+    mapping: Dict[int, int] = {}
+    low = [n for own in part7 for n in own] + part8 + [pages_num] + extra
+    for n in low:
+        mapping[n] = len(mapping) + 1
+    main_xref_num = len(low) + 1
+    lin_num = main_xref_num + 1
+    xref1_num, catalog_num, hint_num = lin_num + 1, lin_num + 2, lin_num + 3
+    nxt = hint_num + 1
+    for n in part6:
+        mapping[n] = nxt
+        nxt += 1
+    objstm_num = nxt if compressed else 0
+    if compressed:
+        nxt += 1
+    for n in compressed:
+        mapping[n] = nxt
+        nxt += 1
+    size = nxt
+
+    objects = dict(objects)
+    objects[pages_num] = b"<< /Type /Pages /Count %d /Kids [ %s ] >>" % (
+        len(pages), b" ".join(b"%d 0 R" % p for p in pages))
+    body = {mapping[n]: _renumber(objects[n], mapping) for n in objects}
+
+    # corpo depois das dicas: offsets relativos ao início da 1ª página
+    chunks: List[bytes] = []
+    rel: Dict[int, int] = {}
+    pos = 0
+
+    def emit(num: int, data: bytes):
+        nonlocal pos
+        rel[num] = pos
+        chunks.append(data)
+        pos += len(data)
+
+    for n in part6:
+        emit(mapping[n], _obj(mapping[n], body[mapping[n]]))
+    if compressed:
+        members, offs, p = [], [], 0
+        for n in compressed:
+            offs.append(b"%d %d" % (mapping[n], p))
+            members.append(body[mapping[n]] + b"\n")
+            p += len(members[-1])
+        header = b" ".join(offs) + b"\n"
+        data = zlib.compress(header + b"".join(members), 9)
+        emit(objstm_num, _stream_obj(
+            objstm_num, b"/Type /ObjStm /N %d /First %d /Filter /FlateDecode" % (len(compressed), len(header)),
+            data))
+    end_first = pos
+    for n in low:
+        emit(mapping[n], _obj(mapping[n], body[mapping[n]]))
+    main_xref_rel = pos
+
+    # partes fixas do início (larguras fixas, preenchidas ao final)
+    head = b"%PDF-1.5\n%\xe2\xe3\xcf\xd3\n"
+    lin_tpl = (b"<< /Linearized 1 /L " + _LIN_FIELD + b" /H [ " + _LIN_FIELD + b" " + _LIN_FIELD
+               + b" ] /O %d /E " + _LIN_FIELD + b" /N %d /T " + _LIN_FIELD + b" >>")
+    lin_len = len(_obj(lin_num, lin_tpl % (0, 0, 0, mapping[pages[0]], 0, len(pages), 0)))
+    high = list(range(lin_num, size))
+    trailer_extra = _trailer_extra(mapping.get(info_num, 0), objects.get(info_num, b""), size)
+    xref1_tpl = (b"/Type /XRef /Index [ %d %d ] /W [ %d %d %d ] /Size %d /Root %d 0 R %s /Prev "
+                 % ((lin_num, len(high)) + _XREF_W + (size, catalog_num, trailer_extra)) + _LIN_FIELD)
+    xref1_len = len(_stream_obj(xref1_num, xref1_tpl % 0, bytes(sum(_XREF_W) * len(high))))
+    catalog = _obj(catalog_num, b"<< /Type /Catalog /Pages %d 0 R >>" % mapping[pages_num])
+    hint_at = len(head) + lin_len + xref1_len + len(catalog)
+
+    # dicas com offsets ajustados (sem o próprio stream de dicas)
+    starts = [rel[mapping[pages[0]]]] + [rel[mapping[own[0]]] for own in part7]
+    ends = [end_first] + starts[2:]
+    if part7:
+        ends.append(rel[mapping[(part8 or [pages_num])[0]]])
+    counts = [len(part6) + (1 if compressed else 0)] + [len(own) for own in part7]
+    page_ranges = [(cnt, end - start) for cnt, start, end in zip(counts, starts, ends)]
+
+    first_entries = [mapping[n] for n in part6] + ([objstm_num] if compressed else [])
+    shared_index = {num: i for i, num in enumerate(first_entries)}
+    for n in part8:
+        shared_index[mapping[n]] = len(shared_index)
+    order = sorted(rel, key=rel.get)
+    sizes = {num: (rel[order[k + 1]] if k + 1 < len(order) else main_xref_rel) - rel[num]
+             for k, num in enumerate(order)}
+    shared_groups = [sizes[num] for num in first_entries] + [sizes[mapping[n]] for n in part8]
+
+    shared_refs: List[List[int]] = [[]]
+    for i in range(1, len(pages)):
+        refs = {shared_index[mapping[n]] for n in reach[i]
+                if n not in in_objstm and mapping[n] in shared_index and n not in part7[i - 1]}
+        if any(n in in_objstm for n in reach[i]):
+            refs.add(shared_index[objstm_num])
+        shared_refs.append(sorted(refs))
+
+    hint_data, hint_s = _hint_tables(
+        page_ranges, shared_groups, shared_refs,
+        first_page_offset=hint_at + starts[0],
+        nshared_first_page=len(first_entries),
+        first_shared=(mapping[part8[0]], hint_at + rel[mapping[part8[0]]]) if part8 else (0, 0),
+    )
+    hint = _stream_obj(hint_num, b"/Filter /FlateDecode /S %d" % hint_s, zlib.compress(hint_data, 9))
+
+    # offsets absolutos
+    base = hint_at + len(hint)
+    offsets = {num: base + r for num, r in rel.items()}
+    offsets[lin_num] = len(head)
+    offsets[xref1_num] = len(head) + lin_len
+    offsets[catalog_num] = len(head) + lin_len + xref1_len
+    offsets[hint_num] = hint_at
+    main_xref_at = base + main_xref_rel
+
+    main_rows = [(0, 0, 0xFFFF)] + [(1, offsets[n], 0) for n in range(1, main_xref_num)]
+    main_rows.append((1, main_xref_at, 0))
+    main_xref = _stream_obj(
+        main_xref_num,
+        b"/Type /XRef /W [ %d %d %d ] /Size %d %s /Filter /FlateDecode" % (_XREF_W + (main_xref_num + 1, trailer_extra)),
+        zlib.compress(_xref_rows(main_rows), 9),
+    )
+    tail = b"startxref\n%d\n%%%%EOF\n" % offsets[xref1_num]
+    total = main_xref_at + len(main_xref) + len(tail)
+
+    packed = {num: i for i, num in enumerate(mapping[n] for n in compressed)}
+    xref1_rows = [(2, objstm_num, packed[n]) if n in packed else (1, offsets[n], 0) for n in high]
+    xref1 = _stream_obj(xref1_num, xref1_tpl % main_xref_at, _xref_rows(xref1_rows))
+    lin = _obj(lin_num, lin_tpl % (
+        total, hint_at, len(hint), mapping[pages[0]], base + end_first, len(pages), main_xref_at - 1))
+
+    out = b"".join([head, lin, xref1, catalog, hint] + chunks + [main_xref, tail])
+    return out
+
+
+def merge_pdf_pages(fragments: List[bytes], linearize: bool = False) -> bytes:
+    """
+    Costura as páginas de vários PDFs (na ordem recebida) num PDF só.
+    Com linearize=True o PDF sai linearizado e com streams de objetos.
+    """
+    objects, pages, pages_num, info_num = collect_pages(fragments)
+    if linearize:
+        return _write_linearized(objects, pages, pages_num, info_num)
+    kids = b" ".join(b"%d 0 R" % p for p in pages)
+    objects[pages_num] = b"<< /Type /Pages /Count %d /Kids [ %s ] >>" % (len(pages), kids)
+    root = pages_num + 1
+    objects[root] = b"<< /Type /Catalog /Pages %d 0 R >>" % pages_num
+    return _write_classic(objects, root, info_num)
+
+
+def linearize_pdf(data: bytes) -> bytes:
+    """Regrava um PDF (ReportLab/Pillow) linearizado e com streams de objetos."""
+    return merge_pdf_pages([data], linearize=True)